@@ -734,7 +734,7 @@ class Configuration():
         # Check if referenced in visibility.yaml
         vispar =  Visibility.params_from_key(self.visibility)
         if vispar is not None:
-            return vispar
+            return Visibility.decode_params(vispar) # Decoded once for all
 
         # Check if the keyword corresponds to a visibility subfolder
         test = Path(folder.parent)
@@ -774,10 +774,11 @@ class GammaRayBurst(object):
             if info == "forced": # Infinitite nights
                 self.vis[loc] = self.vis[loc].force_night()
 
-            else: # Binary - Obsolete - Archived bin files might be not valid
-                import pickle
-                with open(Path(info,self.id+"_"+loc+"_vis.bin"),"r") as f:
-                    self.vis[loc] =  pickle.load(f)
+            else: # Written by Visibility.write, or obsolete binary file
+                fname = Path(info, self.id+"_"+loc+"_vis.npz")
+                if not fname.exists():
+                    fname = fname.with_suffix(".bin")
+                self.vis[loc] = Visibility.read(fname)
 
 ###------------------------------------------------------------------------
     def altaz(self,loc="",dt=0*u.s):
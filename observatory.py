@@ -14,14 +14,14 @@ __all__ = ["xyz"]
 ### Site positions
 xyz = {
    "CTAO":
-         { "North": EarthLocation.from_geocentric( float(5327448.9957829),
-                                                   float(-1718665.73869569),
-                                                   float(3051566.90295403),
-                                                   unit="m"),
-           "South": EarthLocation.from_geocentric( float(1946404.34103884),
-                                                   float(-5467644.29079852),
-                                                   float(-2642728.20144425),
-                                                   unit="m")
+         { "North": EarthLocation.from_geocentric( 5327448.9957829,
+                                                   -1718665.73869569,
+                                                   3051566.90295403,
+                                                   unit=u.m),
+           "South": EarthLocation.from_geocentric( 1946404.34103884,
+                                                   -5467644.29079852,
+                                                   -2642728.20144425,
+                                                   unit=u.m)
            # Requires to have an internet connection
            # Get all possible sites with : EarthLocation.get_site_names()
            # "North": EarthLocation.of_site('Roque de los Muchachos'),
@@ -46,10 +46,10 @@ xyz = {
   # https://www.mpi-hd.mpg.de/hfm/HESS/pages/home/visibility/
   # Warning : use CTA-North for virtual HESS North
   "HESS":
-        { "North": EarthLocation.from_geocentric( float(5327448.9957829),
-                                                  float(-1718665.73869569),
-                                                  float(3051566.90295403),
-                                                  unit="m"),
+        { "North": EarthLocation.from_geocentric( 5327448.9957829,
+                                                  -1718665.73869569,
+                                                  3051566.90295403,
+                                                  unit=u.m),
           "South": EarthLocation.from_geodetic(lat=Angle('-23d16m18.0s'),
                                       lon=Angle('16d30m0.0s'),
                                       height=1800*u.m)
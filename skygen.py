@@ -21,7 +21,12 @@ from pathlib import Path
 import numpy as np
 import json
 import yaml
-from yaml.loader import SafeLoader
+try: # Use the libyaml C implementation if available (much faster)
+    from yaml import CSafeLoader as SafeLoader
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml.loader import SafeLoader
+    from yaml.dumper import SafeDumper
 from datetime import datetime
 
 import matplotlib.pyplot as plt
@@ -68,6 +73,8 @@ class Skies():
     * `yaml` files containing the generated dates and positions. These files
       starts with `DP` (for Dates and Position). They can be used to
       generate other visibilities from the same dates and position.
+      A companion `npz` file with the same name holds the same dates and
+      positions as numpy arrays for a faster reading.
     * `json` file containing the visibility class content of all sources
       in the identifier range.
 
@@ -95,6 +102,7 @@ class Skies():
                        seed       = 2022,
                        newpos     = False,
                        newdate    = False,
+                       nproc      = 1,
                        debug      = False):
         """
         Create de default object from external parameters.
@@ -129,6 +137,8 @@ class Skies():
         newdate: boolean
             If True, if the data are read from source file, the dates are
             re-generated from the given source range.
+        nproc : integer, optional
+            Number of processes computing the visibilities. The default is 1.
         debug : boolean, optional
             If True, print out various information. The default is False.
 
@@ -156,6 +166,7 @@ class Skies():
         self.newpos   = newpos
         self.viskey   = visibility
         self.duration = duration
+        self.nproc    = nproc
 
         # Input parameters (backward compatibilty)
         self.cfg = Configuration()
@@ -175,6 +186,9 @@ class Skies():
         # List of computed visibilities
         self.vis_list = None
 
+        # True when dates and positions have been generated or read
+        self.has_sky  = False
+
     #--------------------------------------------------------------------------
     @classmethod
     def command_line(cls):
@@ -244,6 +258,11 @@ class Skies():
                             default=inst.seed,
                             type=int)
 
+        parser.add_argument('-j', '--nproc',
+                            help ="Number of processes for the visibilities",
+                            default=inst.nproc,
+                            type=int)
+
         parser.add_argument('--debug',
                             dest='debug',
                             action='store_true',
@@ -296,6 +315,7 @@ class Skies():
         inst.newpos   = vals.position
         inst.viskey   = str(vals.visibility)
         inst.duration = vals.days
+        inst.nproc    = vals.nproc
 
         # Input parameters
         if vals.config is not None:
@@ -355,10 +375,14 @@ class Skies():
         found_trigger  = False
 
         # Get information from data files
+        progress = [] # Progress tokens, written by blocks
         for i, item in enumerate(range(self.id1, self.id2+1)):
 
-            if (self.Nsrc <= 10) or (np.mod(i,10) == 0):
-                print("#",item," ",end="")
+            if (self.Nsrc <= 10) or (i % 10 == 0):
+                progress.append(f"# {item}  ")
+                if len(progress) == 100:
+                    sys.stdout.write("".join(progress))
+                    progress.clear()
 
             fname = Path(infolder,
                          self.cfg.data_dir,
@@ -395,6 +419,8 @@ class Skies():
             if self.dbg:
                 print("Found: ", i, self.ra[i], self.dec[i], self.dates[i])
 
+        sys.stdout.write("".join(progress))
+
         year1  = Time(np.min(self.dates), format="mjd", scale="utc").datetime.year
         year2  = Time(np.max(self.dates), format="mjd", scale="utc").datetime.year
         print("\n Year range in source files : ",year1," -",
@@ -416,6 +442,8 @@ class Skies():
                 highlight(" Generating positions (absent from input files")
             self.generate_positions()
 
+        self.has_sky = True
+
     #------------------------------------------------------------------------------
     @classmethod
     def sky_from_yaml(cls,filename, version=None):
@@ -424,6 +452,9 @@ class Skies():
         Read dates and postions from an existing "DP" yaml file.
         The dates are stored as mjd in the file and Time object in the
         instance.
+        If the companion `npz` file written by `sky_to_yaml` exists, the
+        dates and positions are read from it in one go, otherwise they are
+        decoded from the yaml file content.
 
         Parameters
         ----------
@@ -441,8 +472,20 @@ class Skies():
 
         heading(f" Dates and position load from {filename.name:s}")
 
-        infile = open(filename,"r")
-        data =  yaml.load(infile, Loader=SafeLoader)
+        npzfile = Path(filename).with_suffix(".npz")
+        with open(filename,"r") as infile:
+            if npzfile.is_file():
+                # Only the header is decoded, the events are in the npz file
+                header = []
+                for line in infile:
+                    key = line.split(":")[0]
+                    if key.startswith(cls.prfx) \
+                       and key[len(cls.prfx):].isdigit():
+                        break
+                    header.append(line)
+                data = yaml.load("".join(header), Loader=SafeLoader)
+            else:
+                data =  yaml.load(infile, Loader=SafeLoader)
 
         print("File created: ",data["created"])
 
@@ -452,8 +495,8 @@ class Skies():
         if version is None:
             version = data["version"]
 
-        inst = cls(year1 = year1,       Nyears = year2-year1+1,
-                   first = data["id1"], nsrc   = data["nsrc"],
+        inst = cls(year1 = year1,       nyears = year2-year1+1,
+                   first = data["id1"], Nsrc   = data["nsrc"],
                    version     = version,
                    duration    = data["duration"],
                    visibility  = data["key"],
@@ -461,9 +504,18 @@ class Skies():
                    seed        = data["seed"],
                    debug       = False)
 
-        for i, item in enumerate(range(inst.id1, inst.id2+1)):
-            key = inst.prfx+str(item)
-            [inst.dates[i], inst.ra[i], inst.dec[i]] = data[key].split()
+        if npzfile.is_file():
+            with np.load(npzfile) as table:
+                inst.dates = table["mjd"]
+                inst.ra    = table["ra"]
+                inst.dec   = table["dec"]
+        else:
+            table = np.array([data[inst.prfx+str(item)].split()
+                              for item in range(inst.id1, inst.id2+1)],
+                             dtype=float)
+            [inst.dates, inst.ra, inst.dec] = table.T
+
+        inst.has_sky = True
 
         return inst
 
@@ -515,6 +567,8 @@ class Skies():
         self.generate_positions() # RA, DEC in degrees
         self.generate_dates()     # Dates
 
+        self.has_sky = True
+
     #--------------------------------------------------------------------------
     def create_output_folder(self):
         """
@@ -563,38 +617,53 @@ class Skies():
         heading("Creating visibilities")
 
         # Check that dates and position have been generated
-        if self.ra.all == 0:
+        if not self.has_sky:
             sys.exit("Dates and position are missing")
 
         # Get visibility paramters from default file
         param =  (True, Visibility.params_from_key(self.viskey,
                                                    parfile=paramfile))[1]
+        param = Visibility.decode_params(param) # Decoded once for all sources
 
         vislist = []
 
+        # Sites and time windows obtained once for all sources
+        sites = tuple((loc, obs.xyz[observatory][loc])
+                      for loc in ("North", "South"))
+        tstart = Time(self.dates, format="mjd", scale="utc")
+        tstop  = tstart + self.duration
+
         # Loop over items
         for i, item in enumerate(range(self.id1, self.id2+1)):
 
-            if (self.Nsrc <= 10) or (np.mod(i,10) == 0):
-                print("#",item," ",end="")
-
             # print(item, self.ra[i], self.dec[i], self.dates[i])
             radec = SkyCoord(self.ra[i]*u.deg,self.dec[i]*u.deg, frame='icrs')
-            tvis1 = Time(self.dates[i],format="mjd",scale="utc")
-            tvis2 = tvis1 + self.duration
+            tvis1 = tstart[i]
+            tvis2 = tstop[i]
 
-            for loc in ["North", "South"]:
+            for loc, site in sites:
 
                 vis = Visibility(pos    = radec,
-                                 site   = obs.xyz[observatory][loc],
+                                 site   = site,
                                  window = [tvis1, tvis2],
                                  name   = str(item)+"_"+loc,
                                  status = "")
-                vis.compute(param=param)
+                vislist.append(vis)
 
-                if self.dbg: vis.print()
+        # Compute the visibilities by blocks sharing the transforms, the
+        # blocks being possibly shared among several processes.
+        # The last source of each block is displayed when computed.
+        nblock = 200*self.nproc
+        for i in range(0, len(vislist), nblock):
+            block = vislist[i:i+nblock]
+            Visibility.compute_many(block, param=param, nproc=self.nproc)
+            vislist[i:i+nblock] = block # Replaced if computed by workers
+            sys.stdout.write(f"# {block[-1].name.split('_')[0]}  ")
+            sys.stdout.flush()
+
+        if self.dbg:
+            for vis in vislist: vis.print()
 
-                vislist.append(vis)
         print(" - Done")
         self.vis_list = np.array(vislist)
 
@@ -616,37 +685,38 @@ class Skies():
 
         filename = Path(self.out_folder,"DP_"+self.basename+".yaml")
 
+        meta = {"created" : datetime.now(),
+                "id1"     : self.id1,
+                "nsrc"    : self.Nsrc,
+                "seed"    : self.seed,
+                "start"   : self.year1,
+                "stop"    : self.year2,
+                "config"  : str(Path(self.config).parent.parent)
+                            if self.config is not None else None,
+                "basedir" : str(self.out_folder.parent.parent),
+                "key"     : self.viskey,
+                "duration": float(self.duration),
+                "version" : str(self.version)}
+
+        dstr  = Time(self.dates,format="mjd",scale="utc").isot
+        lines = [f"{self.prfx}{item:d}: {date:20.10f} {ra:20f} {dec:20f} # {iso}\n"
+                 for item, date, ra, dec, iso
+                 in zip(range(self.id1, self.id2+1),
+                        self.dates, self.ra, self.dec, dstr)]
+
         with open(filename,"w") as out:
 
             heading(" Dumping generated dates and posiiton")
             print(f" Output: {filename}")
 
-            print(f"created: {datetime.now()}",file=out)
-            print(f"id1: {self.id1}",file=out)
-            print(f"nsrc: {self.Nsrc}",file=out)
-            print(f"seed: {self.seed:d}",file=out)
-            print(f"start: {self.year1}",file=out)
-            print(f"stop: {self.year2}",file=out)
+            yaml.dump(meta, out, Dumper=SafeDumper, sort_keys=False)
+            out.writelines(lines)
 
-            if self.config is not None:
-                print(f"config: {str(Path(self.config).parent.parent)}",file=out)
-            else:
-                print(f"config: {self.config}",file=out)
-
-            print(f"basedir: {str(self.out_folder.parent.parent)}",file=out)
-            print(f"key: {self.viskey}",file=out)
-            print(f"duration: {self.duration}",file=out)
-            print(f"version: {self.version:s}",file=out)
-
-            for i, item in enumerate(range(self.id1, self.id2+1)):
-                date =  self.dates[i]
-                dstr =  Time(self.dates[i],format="mjd",scale="utc").isot
-                ra   =  self.ra[i]
-                dec  =  self.dec[i]
-                print(f"ev{item:d}: {date:20.10f} {ra:20f} {dec:20f} # {dstr}", file=out)
-
-            out.close()
-            print("Done!")
+        # Companion binary table, read back in one go by sky_from_yaml
+        np.savez(filename.with_suffix(".npz"),
+                 id  = np.arange(self.id1, self.id2+1),
+                 mjd = self.dates, ra = self.ra, dec = self.dec)
+        print("Done!")
 
         return filename
 
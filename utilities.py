@@ -8,6 +8,10 @@ A bucnh of utility functions used in `SoHAPPy`.
 """
 
 import tarfile
+import io
+import functools
+import contextlib
+import hashlib
 from pathlib import Path
 
 import sys
@@ -16,17 +20,25 @@ import os
 import shutil
 import datetime
 
+import numpy as np
 from   astropy.time import Time
 
-__all__ = ["subset_ids","get_filename","file_from_tar","backup_file",
+__all__ = ["subset_ids","iter_subset_ids","get_filename",
+           "file_from_tar","files_from_tar","open_tar","backup_file",
            "Df", "Dp"]
 
+# Folder where the files extracted from archives are kept between runs.
+# Disabled (None) unless the SOHAPPY_TAR_CACHE environment variable is set,
+# as nothing is ever removed from it.
+tar_cache = os.environ.get("SOHAPPY_TAR_CACHE")
+
 ###----------------------------------------------------------------------------
-def subset_ids(nmax, nsets, debug=False):
+def subset_ids(nmax, nsets, as_list=True, debug=False):
     """
     This is a simple code defining `nsets` interval for a list of integer
     starting at 1 up to `nmax`. If `nmax` is not divisible by `nsets`, the rest
-    gives and extra set.
+    is shared among the first sets that get one more element, so that the
+    set sizes differ by one at most.
 
     Parameters
     ----------
@@ -34,47 +46,68 @@ def subset_ids(nmax, nsets, debug=False):
         Maximal nubmer.
     nsets : integer
         Number of sets.
+    as_list : Boolean, optional
+        If False, the intervals are returned as a numpy array.
+        The default is True.
     debug : Boolean, optional
         If True, verbosy. The default is False.
 
     Returns
     -------
-    dsets : list of List
-        The list of concsecutiveintervals.
+    dsets : list of List or numpy array
+        The list of concsecutiveintervals, or an integer array of shape
+        (number of intervals, 2) with the low and high values in columns.
 
     """
-    if nsets >= nmax:
-        return [1,nmax]
-
-    delta = int(nmax/nsets) # regular set size
-    rest  = nmax%nsets # Last set size
-
-    # Define low and high values of the intervals
-    ids_low  = list(range(1,nmax,delta))
-    ids_high = list(range(delta,min(nmax+delta,nmax),delta))
-    if len(ids_high) < len(ids_low):
-        ids_high += [nmax]
-    elif ids_high[-1]<nmax:
-        ids_high[-1] = nmax
+    # The intervals are defined once, in iter_subset_ids
+    dsets = [list(ids) for ids in iter_subset_ids(nmax, nsets)]
+    if not as_list:
+        dsets = np.array(dsets, dtype=np.int64).reshape(-1, 2)
 
     if debug:
+        delta, rest = divmod(nmax, max(nsets, 1))
         print("steps = ",delta, " uncovered = ",rest)
-        print(ids_low, " -> ",len(ids_low)," items")
-        print(ids_high, " -> ",len(ids_high)," items")
-
-    # Create interval list
-    dsets = [[idl, idh] for (idl, idh) in zip(ids_low, ids_high)]
+        print(dsets, " -> ",len(dsets)," items")
 
-    # Check counts
-    icount=0
-    for ds in dsets:
-        icount += len(range(ds[0],ds[1]+1))
-    if icount != nmax:
-        print(dsets)
-        sys.exit(f"Total entries = {icount:}")
+    # Check counts - the partition covers nmax by construction
+    if debug:
+        icount = sum(h - l + 1 for l, h in dsets)
+        if icount != nmax:
+            print(dsets)
+            sys.exit(f"Total entries = {icount:}")
 
     return dsets
 
+###----------------------------------------------------------------------------
+def iter_subset_ids(nmax, nsets):
+    """
+    Generator yielding the intervals of :func:`subset_ids` one by one, for
+    consumers that do not need the full list. There are at most `nmax`
+    intervals.
+
+    Parameters
+    ----------
+    nmax : integer
+        Maximal nubmer.
+    nsets : integer
+        Number of sets.
+
+    Yields
+    ------
+    tuple of integer
+        The low and high values of the current interval.
+
+    """
+
+    nsets = min(nsets, nmax)
+    if nsets <= 0: # No identifier, no interval (as subset_ids)
+        return
+
+    delta, rest = divmod(nmax, nsets) # Regular set size, sets with one more
+
+    for i in range(nsets):
+        yield (i*delta + min(i, rest) + 1, (i+1)*delta + min(i+1, rest))
+
 ###----------------------------------------------------------------------------
 def get_filename(filename):
     """
@@ -104,9 +137,18 @@ def get_filename(filename):
     return filename
 
 ###----------------------------------------------------------------------------
-def file_from_tar(folder=None, tarname=None, target=None):
+def file_from_tar(folder=None, tarname=None, target=None, tar=None):
     """
     Extract a given file from a tar file.
+    The extracted content is kept in memory so that a new request for the
+    same file does not read the archive again.
+    Several files can be extracted from an archive opened once with
+    :func:`open_tar`, as follows:
+
+    .. code-block:: python
+
+        with open_tar(folder) as tar:
+            files = [file_from_tar(target=name, tar=tar) for name in names]
 
     Parameters
     ----------
@@ -118,6 +160,9 @@ def file_from_tar(folder=None, tarname=None, target=None):
     target : string, optional
         The file to be found in the archive, or a file name with the same
         extension. The default is None.
+    tar : TarFile, optional
+        An already opened archive, supersedes `folder` and `tarname`.
+        The default is None.
 
     Returns
     -------
@@ -125,21 +170,195 @@ def file_from_tar(folder=None, tarname=None, target=None):
 
     """
 
+    if tar is not None:
+        if target is None:
+            sys.exit("file_from_tar: Specify a target in the archive")
+        member = _extract_member(tar, target)
+    else:
+        member = _tar_member(folder, tarname, target)
+
+    if member is None:
+        return None
+
+    datafile      = io.BytesIO(member[1])
+    datafile.name = member[0]
+
+    return datafile
+
+###----------------------------------------------------------------------------
+@contextlib.contextmanager
+def open_tar(folder=None, tarname=None):
+    """
+    Open a tar file once, for several calls to :func:`file_from_tar`.
+
+    Parameters
+    ----------
+    folder : string, optional
+        The folder to scan. The default is "None".
+    tarname : string, optional
+        The archive name in case more than one in the folder.
+        The default is None.
+
+    Yields
+    ------
+    TarFile
+        The opened archive, closed when leaving the context.
+
+    """
+
+    tarname = _find_archive(folder, tarname)
+    if tarname is None:
+        sys.exit(f"open_tar: No .tar.gz file in {folder}")
+
+    with _open_archive(tarname) as tar:
+        yield tar
+
+###----------------------------------------------------------------------------
+def files_from_tar(folder=None, tarname=None, targets=None):
+    """
+    Extract several files from a tar file in a single pass on the archive,
+    that stops as soon as all of them are found.
+    Contrary to :func:`file_from_tar`, the names have to match exactly.
+
+    Parameters
+    ----------
+    folder : string, optional
+        The folder to scan. The default is "None".
+    tarname : string, optional
+        The archive name in case more than one in the folder.
+        The default is None.
+    targets : list of string, optional
+        The files to be found in the archive. The default is None.
+
+    Returns
+    -------
+    Dictionnary
+        Pointers to the files in memory with the file names as keys, the
+        files not found in the archive being absent. None if no archive
+        was found.
+
+    """
+
+    if not targets:
+        sys.exit("files_from_tar: Specify targets in the archive")
+
+    tarname = _find_archive(folder, tarname)
+    if tarname is None:
+        return None
+
+    wanted = set(targets)
+    files  = {}
+
+    with _open_archive(tarname) as tar:
+
+        for member in tar:
+            if member.name in wanted:
+                datafile = io.BytesIO(tar.extractfile(member).read(member.size))
+                datafile.name = member.name
+                files[member.name] = datafile
+                if len(files) == len(wanted):
+                    break
+
+    return files
+
+###----------------------------------------------------------------------------
+def _tar_member(folder, tarname, target):
+    """
+    Get the name and the content of a given file from a tar file.
+    See :func:`file_from_tar` for the parameters.
+    The content is kept in memory for the archive path and modification
+    time, so that a modified archive is read again.
+
+    Returns
+    -------
+    A (name, bytes) tuple, None if no archive was found
+
+    """
+
+    if target is None:
+        sys.exit("file_from_tar: Specify a target in the archive")
+
+    tarname = _find_archive(folder, tarname)
+    if tarname is None:
+        return None
+
+    return _read_member(str(Path(tarname).resolve()),
+                        os.stat(tarname).st_mtime_ns, target)
+
+###----------------------------------------------------------------------------
+@functools.lru_cache(maxsize=128)
+def _read_member(tarname, mtime, target):
+    """
+    Get the name and the content of a given file from a tar file, the
+    modification time being part of the cache key only.
+    If `tar_cache` is not None, the extracted file and its name in the
+    archive are also kept in a sub-folder of it named from the archive path,
+    modification time and the target so that it is not extracted again by
+    later runs, unless the archive changes.
+    """
+
+    # Get the file from the disk cache if already extracted
+    cache = None
+    if tar_cache is not None:
+        key   = f"{tarname}:{mtime}:{target}"
+        cache = Path(tar_cache, hashlib.sha1(key.encode()).hexdigest())
+        try:
+            name = Path(cache, "name").read_text()
+            data = Path(cache, "data").read_bytes()
+            print(f"file_from_tar:  {name} read from {cache}")
+            return (name, data)
+        except FileNotFoundError:
+            pass
+
+    # Seekable mode is kept as the extension match can precede the target
+    with _open_archive(tarname) as tar:
+        member = _extract_member(tar, target)
+
+    # Store to the disk cache - written aside, then renamed when complete
+    # The cache is an optimisation, failing to write it is not an error
+    if cache is not None:
+        tmp = cache.with_name(f"{cache.name}_{os.getpid()}")
+        try:
+            tmp.mkdir(parents=True, exist_ok=True)
+            Path(tmp, "data").write_bytes(member[1])
+            Path(tmp, "name").write_text(member[0])
+            os.replace(tmp, cache)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return member
+
+###----------------------------------------------------------------------------
+@contextlib.contextmanager
+def _open_archive(tarname):
+    """
+    Open a gzipped tar file for reading, the archive being closed when
+    leaving the context.
+    """
+
+    # The compressed stream is read by small chunks, use a large file buffer
+    with open(tarname, "rb", buffering=1<<20) as raw, \
+         tarfile.open(fileobj=raw, mode="r:gz") as tar:
+        yield tar
+
+###----------------------------------------------------------------------------
+def _find_archive(folder, tarname):
+    """
+    Get the archive file name, searched in the folder if not given.
+    Returns None if no archive was found.
+    """
+
     tag = "file_from_tar: "
 
-    ### ------------------------
-    ### Get archive file name
-    ### ------------------------
     if not Path(folder).is_dir():
         sys.exit(f"{tag} Folder not found")
 
-    if target is None:
-        sys.exit("f{tag} Specify a target in the archive")
-
     if tarname is None:
         # Find the archive in the folder
-        p = Path(folder).glob('*.tar.gz')
-        files = [x for x in p] # if x.is_file()] <- Crash when not connected
+        # Directory entries carry the file type, no stat call per file
+        with os.scandir(folder) as entries:
+            files = [Path(x.path) for x in entries
+                     if x.name.endswith(".tar.gz") and x.is_file()]
         if len(files) > 1:
             sys.exit(f"{tag} More than one .tar.gz file, specify a name")
         elif len(files) == 0:
@@ -148,48 +367,64 @@ def file_from_tar(folder=None, tarname=None, target=None):
             tarname = files[0]
     print(f"{tag} found {tarname}")
 
-    ### ------------------------
-    ### Open tar file, get members, check data.txt exists
-    ### ------------------------
-    tar = tarfile.open(tarname, "r:gz")
+    return tarname
+
+###----------------------------------------------------------------------------
+def _extract_member(tar, target):
+    """
+    Get the name and content of a given file, or of the only file with the
+    same extension, from an opened archive.
+    """
+
+    tag = "file_from_tar: "
+
+    # Single pass on the members: stop at the target if found, otherwise
+    # collect the members with the same extension
+    match    = None
+    extmatch = []
+    suffix   = Path(target).suffix
+    for member in tar:
+        if member.name == target:
+            match = member
+            break
+        if Path(member.name).suffix == suffix:
+            extmatch.append(member)
 
     # If the target is not found explicitely, tires a file with same extension
-    if not target in [member.name for member in tar.getmembers()]:
+    if match is None:
 
         print(f"{tag} No {target} in archive. Tries with extension")
 
-        # find members with correct extension
-        extmatch = \
-            [(m.name if Path(m.name).suffix==Path(target).suffix else None) \
-             for m in tar.getmembers()]
-        extmatch = list(filter(None,extmatch)) # Remove None
-
         if len(extmatch) > 1:
             sys.exit(f"{tag} More than one file matching in archive (try largest?)")
         elif len(extmatch) == 0:
             sys.exit(f"{tag} No file matching extension in the archive")
         else:
-            print(f"{tag} {extmatch[0]} matches {target}")
-            target = extmatch[0]
+            print(f"{tag} {extmatch[0].name} matches {target}")
+            match  = extmatch[0]
+            target = match.name
 
     # At this stage, ether the target was found or deduced from the extension
     print(f"{tag} A file matching {target} was found")
-    datafile = tar.extractfile(target)
+    # TarInfo given (no new member scan), and read sized to the member so that
+    # it is done at once rather than by default buffer chunks
+    data = tar.extractfile(match).read(match.size)
 
-    return datafile
+    return (match.name, data)
 
 ###----------------------------------------------------------------------------
 def backup_file(filename,folder=None, dbg=False):
 
     """
     Copy a file to a result folder.
-    If it already exists, make a backup with the date.
+    If it already exists, the existing file is renamed with the time as a
+    backup (a rename, not a copy, as it stays in the same folder).
 
     Parameters
     ----------
-    file : TYPE
-        DESCRIPTION.
-    folder : String, optional
+    filename : String or Path
+        The file to be copied.
+    folder : String or Path, optional
         Output folder. The default is None.
     dbg : Boolean, optional
         If True, display messages. The default is False.
@@ -201,23 +436,25 @@ def backup_file(filename,folder=None, dbg=False):
     """
 
     # Create result folder if not exisitng
-    if not os.path.exists(folder):
-        if dbg:
-            print(" *** Creating output folder ",folder)
-        os.makedirs(folder)
+    if dbg:
+        print(" *** Output folder ",folder)
+    Path(folder).mkdir(parents=True, exist_ok=True)
 
-    output_file = folder+"/"+filename
+    output_file = Path(folder, Path(filename).name)
 
-    if os.path.exists(output_file):
-        nw = datetime.datetime.now()
-        output_file = output_file + "_" \
-                                  + str(nw.hour) \
-                                  + str(nw.minute) \
-                                  + str(nw.second)
+    # Keep an existing output aside - no prior existence check
+    backup = output_file.with_name(
+                f"{output_file.name}_{datetime.datetime.now():%H%M%S}")
+    try:
+        output_file.replace(backup)
+        if dbg:
+            print("   ----",output_file," saved as ",backup)
+    except FileNotFoundError:
+        pass
 
-    shutil.copy(filename, output_file)
+    shutil.copyfile(filename, output_file) # Mode bits not needed
     if dbg:
-        print("   ----",filename," copied to ",output_file())
+        print("   ----",filename," copied to ",output_file)
 
 ###------------------------------------------------------------------------
 def Df(x):
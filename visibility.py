@@ -15,29 +15,158 @@ for the default horizon value (10 degrees) and for the nights found within
 """
 
 import warnings
+import contextlib
+import functools
 
 import sys
 import json
+import pickle
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 import yaml
-from yaml import SafeLoader
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml.loader import SafeLoader
 
 import numpy as np
 from pathlib import Path
+import erfa
 
 import astropy.units as u
 from   astropy.time import Time
-from   astropy.coordinates import AltAz, SkyCoord, get_moon, EarthLocation
+from   astropy.coordinates import AltAz, SkyCoord, get_moon, get_sun, \
+                                  EarthLocation, GCRS, CartesianRepresentation
+from   astropy.coordinates.erfa_astrom import erfa_astrom, \
+                                             ErfaAstromInterpolator
 from   astropy.table import Table
 from   astropy.io import fits
+from   astropy.utils import iers
 
 from observatory import xyz as obs_loc
 from niceprint import Log
-from utilities import get_filename, Df, Dp
+from utilities import get_filename
 
-from astroplan import Observer, FixedTarget, moon_illumination
+from astroplan import moon_illumination, FixedTarget
 from moon import moon_alt_plot, moonlight_plot, moon_dist_plot  #, moonphase_plot
 
-__all__ = ["Visibility"]
+__all__ = ["Visibility", "IntervalSet"]
+
+# Dates far in the future are "dubious" for ERFA, which is irrelevant here:
+# silence these warnings once for all instead of at each printout
+warnings.filterwarnings("ignore", category=erfa.ErfaWarning)
+
+###----------------------------------------------------------------------------
+@contextlib.contextmanager
+def _fast_transforms(step):
+    """
+    Context for the AltAz transforms on time grids: the astrometry is
+    interpolated with the given time step, and the IERS table is not
+    refreshed (no lazy download) while the transforms are running.
+    """
+    with erfa_astrom.set(ErfaAstromInterpolator(step)), \
+         iers.conf.set_temp("auto_max_age", None):
+        yield
+
+# AltAz frames only depend on the site, they are shared by all the instances
+# and kept for the whole session (there are only a few sites)
+_altaz_cache    = {}
+
+# Parsed visibility parameter files, read once per session
+_visdict_cache  = {}
+
+###############################################################################
+class IntervalSet():
+
+    """
+    A set of time periods stored as two arrays of Julian days, the starts and
+    the stops, so that they can be used in vectorised computations.
+    For backward compatibility, the instances behave as the list of
+    [Time, Time] pairs used formerly (length, iteration, indexing), the list
+    being [[]] if there is no period. This list is built once, on first use.
+
+    """
+
+    ###------------------------------------------------------------------------
+    def __init__(self, jd=None):
+        """
+        Create an IntervalSet instance.
+
+        Parameters
+        ----------
+        jd : numpy array, optional
+            The periods as an (N,2) array of Julian days. The default is None,
+            i.e. no period.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        jd = np.asarray([] if jd is None else jd, dtype=float).reshape(-1, 2)
+
+        self.starts = jd[:, 0].copy()
+        self.stops  = jd[:, 1].copy()
+        self.times  = None # List of Time pairs, built when required
+
+    ###------------------------------------------------------------------------
+    @classmethod
+    def from_times(cls, tlist):
+        """
+        Create an instance from a list of Time pairs, possibly [[]].
+
+        Parameters
+        ----------
+        tlist : List of Time intervals
+            The periods.
+
+        Returns
+        -------
+        IntervalSet instance
+            Instance.
+
+        """
+
+        return cls([[t[0].jd, t[1].jd] for t in tlist if len(t) != 0])
+
+    ###------------------------------------------------------------------------
+    @property
+    def jd(self):
+        """ The periods as an (N,2) array of Julian days. """
+        return np.stack([self.starts, self.stops], axis=1)
+
+    ###------------------------------------------------------------------------
+    def as_times(self):
+        """
+        Get the periods as a list of Time pairs, [[]] if there is no period.
+
+        Returns
+        -------
+        List of Time intervals
+            The periods.
+
+        """
+
+        if self.times is None:
+            if len(self.starts) == 0:
+                self.times = [[]]
+            else:
+                t1 = Time(self.starts, format="jd", scale="utc")
+                t2 = Time(self.stops,  format="jd", scale="utc")
+                self.times = [[ta, tb] for ta, tb in zip(t1, t2)]
+
+        return self.times
+
+    ###------------------------------------------------------------------------
+    def __len__(self):
+        return max(len(self.starts), 1) # [[]] if empty
+
+    def __iter__(self):
+        return iter(self.as_times())
+
+    def __getitem__(self, i):
+        return self.as_times()[i]
 
 ###############################################################################
 class Visibility():
@@ -64,12 +193,16 @@ class Visibility():
     -0.244 and -0.284 degree
 
     """
-    ignore = []
+    ignore = ["tstart_jd", "tstop_jd",
+              "altmin_deg", "moon_maxalt_deg", "moon_mindist_deg"]
     """ Members to be ignored when exported to Json. """
 
     def_vis_dicts  = "visibility.yaml"
     """ default visibility parameter file """
 
+    astrom_step = 1*u.h
+    """ Time step of the interpolated astrometry used for the AltAz grids """
+
     ###------------------------------------------------------------------------
     def __init__(self, pos    = SkyCoord(0*u.deg,0*u.deg, frame='icrs'),
                        site   = None,
@@ -101,11 +234,15 @@ class Visibility():
 
         self.status  = status # Status of the instance, e.g. `recomputed`
         self.site    = site
-        self.target  = FixedTarget(coord=pos, name="Source")
+        self.target  = pos # Bare SkyCoord, no astroplan FixedTarget
         self.tstart  = window[0]
         self.tstop   = window[1]
         self.name    = name
 
+        # Window limits in Julian days, for the float comparisons
+        self.tstart_jd = float(getattr(window[0], "jd", window[0]))
+        self.tstop_jd  = float(getattr(window[1], "jd", window[1]))
+
         # GRB Minimal allowed altitude
         self.altmin  = 10*u.deg
 
@@ -114,6 +251,9 @@ class Visibility():
         self.moon_mindist    =  0*u.deg # Minimum distance to source
         self.moon_maxlight   =  1       # Maximum allowed brightness
 
+        # Same thresholds as plain floats in degrees, for the comparisons
+        self.set_floats()
+
         self.vis         = True
         # These three variables were defined by M.G.Bernardini in the first
         # version of the visibilty, without moon veto, and with a visibility
@@ -160,9 +300,10 @@ class Visibility():
         return
 
     ###-----------------------------------------------------------------------
-    def compute(self, param = None,
-                      npt   = 150,
-                      debug = False):
+    def compute(self, param   = None,
+                      npt     = 48,
+                      samples = None,
+                      debug   = False):
 
         """
         Compute the visibility periods until the end of the last night within
@@ -209,7 +350,12 @@ class Visibility():
             A dictionnary of parameters to compute the visibility.
             The default is None.
         npt : integer, optional
-            Number of grid points for horizon crossing. The default is 150.
+            Number of grid points for horizon crossing. The default is 48.
+        samples : tuple, optional
+            Time grid in Julian days and dictionnary of the corresponding
+            `sun`, `moon` and `source` altitudes in degrees, as obtained by
+            :func:`compute_many`. Computed from :func:`grid` if None.
+            The default is None.
         debug : bool, optional
             Print additional comments at excecution time if True .
             The default is False.
@@ -224,137 +370,111 @@ class Visibility():
         # Decode the parameter dictionnay - keep default otherwise
         if param is not None:
             # observatory = param["where"]
-            self.altmin        = u.Quantity(param["altmin"])
-            self.moon_maxalt   = u.Quantity(param["altmoon"])
-            self.moon_mindist  = u.Quantity(param["moondist"])
+            param = self.decode_params(param) # No-op if already decoded
+            self.altmin        = param["altmin"]
+            self.moon_maxalt   = param["altmoon"]
+            self.moon_mindist  = param["moondist"]
             self.moon_maxlight = param["moonlight"]
             self.depth         = param["depth"]
             self.skip          = param["skip"]
 
         self.status = "Computed"
-
-        obs  = Observer(location= self.site, name= self.name, timezone="utc")
+        self.set_floats()
 
         self.vis = False
         self.vis_night = False
         self.vis_prompt  = False
 
-        ###---------------------
-        ### Find the nights  ---
-        ###---------------------
-        is_night, self.t_twilight  = self.nights(obs, npt=npt)
-        if len(self.t_twilight) ==0:
-            self.t_true  = [[]]
-            return self
+        # All the AltAz transforms below are done on time grids for which
+        # the astrometry is interpolated instead of being computed at
+        # each point, without any IERS table refresh
+        with _fast_transforms(self.astrom_step):
 
-        ###---------------------
-        ### MOON VETOES (high enough, close enough, bright enough) ---
-        ###---------------------
-        # These are the periods when the Moon is above horizon
-        self.t_moon_up    = self.moon_alt_veto(obs, npt=npt)
-
-        # When Moon is up, check if moonlight is affordable
-        t_moon_veto = [] # This variable is internal !!!
-        for dt in self.t_moon_up:
-            (too_bright, too_close) = self.moonlight_veto(dt)
-            self.moon_too_bright.append(too_bright)
-            self.moon_too_close.append(too_close)
-            # If the Moon being above the horizon it gives too much
-            # light, add the corresponding period to the Moon veto
-            if too_bright or too_close: t_moon_veto.append(dt)
-        # In case there is no Moon veto period, then conclude with
-        # an empty array of [t1,t2] arrays
-        if len(t_moon_veto) == 0: t_moon_veto = [[]]
+            # Common sampling of the Sun, Moon and source altitudes
+            if samples is None:
+                jd, frame = self.grid(npt=npt)
+                alt = {body: self.altitude(body, frame)
+                       for body in ["sun", "moon", "source"]}
+            else:
+                jd, alt = samples
+
+            ###---------------------
+            ### Find the nights  ---
+            ###---------------------
+            is_night, t_night  = self.nights(samples=(jd, alt["sun"]))
+            self.t_twilight    = IntervalSet(t_night)
+            if len(t_night) ==0:
+                self.t_true  = IntervalSet()
+                return self
+
+            ###---------------------
+            ### MOON VETOES (high enough, close enough, bright enough) ---
+            ###---------------------
+            # These are the periods when the Moon is above horizon
+            t_moon_up      = self.moon_alt_veto(samples=(jd, alt["moon"]))
+            self.t_moon_up = IntervalSet(t_moon_up)
+
+            # When Moon is up, check if moonlight is affordable
+            # (all periods at once)
+            t_moon_veto = t_moon_up # This variable is internal !!!
+            if len(t_moon_up) != 0:
+                (too_bright, too_close) = self.moonlight_veto(t_moon_up)
+                self.moon_too_bright.extend(too_bright.tolist())
+                self.moon_too_close.extend(too_close.tolist())
+                # If the Moon being above the horizon it gives too much
+                # light, keep the corresponding period in the Moon veto
+                t_moon_veto = t_moon_up[too_bright | too_close]
+
+            ###---------------------
+            ### HORIZON ---
+            ###---------------------
+            (high, t_above) = self.horizon(samples=(jd, alt["source"]))
+            self.t_event    = IntervalSet(t_above)
 
         ###---------------------
-        ### HORIZON ---
+        ### Collect the ticks from all periods (authorised and forbidden)
         ###---------------------
-        (high, self.t_event) = self.horizon(obs)
+        # Restrict the windows to the last night end or the GRB data length
+        if self.tstop_jd >= t_night[-1][1]:
+            # Set the end at last night for convenience (Time)
+            self.tstop_jd = t_night[-1][1]
+            self.tstop    = Time(self.tstop_jd, format="jd", scale="utc")
+        t_data = np.array([[self.tstart_jd, self.tstop_jd]])
+
+        # Note : ticks are in Julian days (float), collected from all the
+        # (N,2) period arrays in a single concatenation. np.unique sorts
+        # and also drops the duplicates, which would otherwise give empty
+        # tick intervals (and empty visibility windows).
+        ticks = np.unique(np.concatenate([t_data.ravel(),
+                                          t_night.ravel(),
+                                          t_above.ravel(),
+                                          t_moon_veto.ravel()]))
 
         ###---------------------
-        ### Collect the ticks from all periods (authorised and forbidden)
+        ### Check the visibility within all tick intervals
         ###---------------------
-        # Note : ticks are in mjd (float) to use the sort function
-        # First tick is the start of data
-        ticks = [self.tstart.mjd]
+        # Check if the middle of the tick intervals corresponds to an
+        # authorised or forbidden window
+        tmid = 0.5*(ticks[:-1] + ticks[1:])
 
-        # Restrict the windows to the last night end or the GRB data length
-        if self.tstop < self.t_twilight[-1][1]:
-            # The GRB data stop before the end of last night
-            # print(" >>>> Analysis shortened by lack of data")
-            ticks.extend([self.tstop.mjd])
-        else:
-            # Set the end at last night for convenience (Time)
-            self.tstop = self.t_twilight[-1][1]
+        # The GRB shines (in the limit of the available data
+        bright   = self.inside(tmid, t_data)
 
-        # Add the ticks of all previously computed windows
-        for elt in self.t_twilight :
-            ticks.extend([t.mjd for t in elt])
-        for elt in self.t_event :
-            ticks.extend([t.mjd for t in elt])
-        for elt in t_moon_veto   : # And not only t_moon_alt_veto!
-            ticks.extend([t.mjd for t in elt])
+        # It is night
+        dark     = self.inside(tmid, t_night)
 
-        # Sort in time
-        ticks.sort() # Requires numerical values -> all times are in mjd
+        # It is above the horizon
+        above    = self.inside(tmid, t_above)
 
-        if debug:
-            print("Ticks : ",len(ticks))
-            for t in ticks:
-                print("{:10s} {:<23s} ".format(self.name, Df(t).iso))
+        # The moon authorises the observation
+        not_moon = ~self.inside(tmid, t_moon_veto) # Moon vetoes
 
-        ###---------------------
-        ### Check the visibility within all tick intervals
-        ###---------------------
-        # Loop over slices and check visibility
-        if debug: # Header
-            print(" {:<23s}   {:<23s} {:>10s} {:>6s} {:>6s} {:>6s} {:>6s}"
-                  .format("T1", "T2", "bright", "dark", "above", "moon.","vis."))
-
-        # t_vis   = []
-        self.t_true   = []
-        for i in range(len(ticks)-1):
-            t1 = ticks[i]
-            t2 = ticks[i+1]
-            tmid = 0.5*(t1+t2)
-            # Check if the current tick interval corresponds to an
-            # authorised or forbidden window
-
-            # The GRB shines (in the limit of the available data
-            bright = self.valid(tmid,[[self.tstart,self.tstop]])
-
-            # It is night
-            dark  = self.valid(tmid,self.t_twilight)
-
-            # It is above the horizon
-            above = self.valid(tmid,self.t_event)
-
-            # The moon authorises the observation
-            not_moon = not self.valid(tmid,t_moon_veto) # Moon vetoes
-
-            # In the end the GRB is visible if all conditions are fulfilled
-            visible = bright and dark and above and not_moon
-            # if visible: t_vis.append([t1, t2])
-            if visible: self.t_true.append([ Time(t1,format="mjd"),
-                                             Time(t2,format="mjd") ] )
-            if debug:
-                if np.isinf(t1):
-                    t1 = "--"
-                else :
-                    t1 = Df(t1).iso
-
-                if np.isinf(t2):
-                    t2 = "--"
-                else:
-                    t2 = Df(t2).iso
-                print(" {:>23}   {:>23} {:>10} {:>6} {:>6} {:>6} {:>6}"
-                      .format(t1, t2,
-                              bright, dark, above, not not_moon, visible),
-                      end="")
-                if visible:
-                    print(" *")
-                else:
-                    print()
+        # In the end the GRB is visible if all conditions are fulfilled
+        visible = np.logical_and.reduce([bright, dark, above, not_moon])
+        t_vis   = np.stack([ticks[:-1][visible], ticks[1:][visible]], axis=1)
+
+        if debug:
+            self.print_ticks(ticks, [bright, dark, above, ~not_moon, visible])
 
         ###---------------------------------------
         ### Finalise the visibility windows and flags
@@ -368,21 +488,144 @@ class Visibility():
             self.vis = True
 
         # At least a visibility period for observation
-        # if len(t_vis) > 0:
-        if len(self.t_true) > 0:
+        if len(t_vis) > 0:
             self.vis_night = True
 
             # In this first window the prompt is visible
             # Note that tstart is considered to be grb.t_trig
-            if  self.valid(self.tstart.mjd,[self.t_true[0]]):
+            if  t_vis[0][0] <= self.tstart_jd <= t_vis[0][1]:
                 self.vis_prompt=True
 
         # There is no visibility window at all - sad World
-        else:
-            self.t_true  = [[]]
+        # (the list is [[]] in that case)
+        self.t_true = IntervalSet(t_vis)
 
         return self
 
+    ###-----------------------------------------------------------------------
+    def print_ticks(self, ticks, flags):
+
+        """
+        Print the ticks and the conditions fulfilled in each tick interval.
+        This is for debugging only and kept outside :func:`compute`.
+        The ticks are converted to dates at once.
+
+        Parameters
+        ----------
+        ticks : numpy array
+            Sorted ticks in Julian days.
+        flags : list of numpy arrays
+            The `bright`, `dark`, `above`, `moon` and `visible` booleans
+            of each tick interval.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        iso = Time(ticks, format="jd", scale="utc").iso
+        print("Ticks : ",len(ticks))
+        for t in iso:
+            print("{:10s} {:<23s} ".format(self.name, t))
+
+        print(" {:<23s}   {:<23s} {:>10s} {:>6s} {:>6s} {:>6s} {:>6s}"
+              .format("T1", "T2", "bright", "dark", "above", "moon.","vis."))
+        for i in range(len(ticks) - 1):
+            print(" {:>23}   {:>23} {:>10} {:>6} {:>6} {:>6} {:>6}"
+                  .format(iso[i], iso[i+1], *[bool(x[i]) for x in flags]),
+                  end="")
+            if flags[-1][i]:
+                print(" *")
+            else:
+                print()
+
+    ###-----------------------------------------------------------------------
+    @classmethod
+    def compute_many(cls, vislist, param  = None,
+                                   npt    = 48,
+                                   nbatch = 100,
+                                   nproc  = 1,
+                                   debug  = False):
+
+        """
+        Compute the visibilities of a list of instances.
+        The instances are grouped by site and, by blocks of `nbatch`
+        instances, the Sun, Moon and source altitudes are obtained with one
+        transform per object on a (nbatch, ntimes) array of times, each row
+        being the grid of an instance. The periods are then searched for each
+        instance with :func:`compute` using these altitudes.
+        With `nproc` larger than one, the list is shared in contiguous chunks
+        among worker processes, and the computed instances replace the
+        original ones in the list.
+
+        Parameters
+        ----------
+        vislist : list of Visibility
+            The instances to be computed.
+        param : Dictionnary, optional
+            A dictionnary of parameters to compute the visibility.
+            The default is None.
+        npt : integer, optional
+            Number of grid points per day. The default is 48.
+        nbatch : integer, optional
+            Maximal number of instances sampled at once. The default is 100.
+        nproc : integer, optional
+            Number of worker processes. The default is 1 (no worker).
+        debug : bool, optional
+            Print additional comments at excecution time if True .
+            The default is False.
+
+        Returns
+        -------
+        vislist : list of Visibility
+            The updated instances.
+
+        """
+
+        if nproc > 1 and len(vislist) > nbatch:
+            nchunk = int(np.ceil(len(vislist)/nproc))
+            chunks = [vislist[i:i+nchunk]
+                      for i in range(0, len(vislist), nchunk)]
+            with ProcessPoolExecutor(max_workers=nproc) as ex:
+                done = ex.map(functools.partial(cls.compute_many,
+                                                param  = param,
+                                                npt    = npt,
+                                                nbatch = nbatch,
+                                                debug  = debug), chunks)
+                vislist[:] = [vis for chunk in done for vis in chunk]
+            return vislist
+
+        sites = {}
+        for vis in vislist:
+            sites.setdefault(vis.site_key(), []).append(vis)
+
+        for group in sites.values():
+            for i in range(0, len(group), nbatch):
+                batch = group[i:i+nbatch]
+
+                # Same number of points for all, enough for the longest window
+                tstart = np.array([v.tstart.jd for v in batch])
+                tstop  = np.array([v.tstop.jd  for v in batch])
+                nafter = int(np.ceil(npt*((tstop - tstart).max() + 2)))
+                jd = tstart[:, None] + np.arange(-npt, nafter + 1)/npt
+
+                with _fast_transforms(cls.astrom_step):
+                    frame  = batch[0].altaz_frame(Time(jd, format="jd",
+                                                          scale="utc"))
+                    sun    = batch[0].altitude("sun", frame)
+                    moon   = batch[0].altitude("moon", frame)
+                    radecs = SkyCoord([v.target for v in batch])
+                    source = radecs.reshape(-1, 1).transform_to(frame).alt.deg
+
+                for k, vis in enumerate(batch):
+                    vis.compute(param   = param, npt = npt, debug = debug,
+                                samples = (jd[k], {"sun"    : sun[k],
+                                                   "moon"   : moon[k],
+                                                   "source" : source[k]}))
+
+        return vislist
+
     ###----------------------------------------------------------------------------
     @staticmethod
     def valid(t0,tslices):
@@ -390,12 +633,16 @@ class Visibility():
         """
         Check it t0 in MJD is within the boundaries of tslices given as an
         array of two Time objects.
+        The slices are sorted and do not overlap (as all the periods of this
+        class), so that the flattened limits alternate between starts and
+        stops: t0 is within a slice if it is inserted at an odd position or
+        is equal to a limit.
 
         Parameters
         ----------
         t0 : float
             A time in days.
-        tslices : list
+        tslices : list or IntervalSet
             A list of Astropy Time object pair.
 
         Returns
@@ -405,14 +652,42 @@ class Visibility():
 
         """
         if len(tslices[0]) == 0 : return False # No slice !
-        ok = False
-        for slices in tslices:
-            if t0 >= slices[0].mjd and t0 <= slices[1].mjd:
-                if ok == False: ok = True
-        return ok
+
+        # MJD limits from the Julian days, no Time object needed
+        flat = (Visibility.jd_array(tslices).ravel() - 2400000.5).tolist()
+        i    = bisect_right(flat, t0)
+
+        return bool(i & 1) or flat[i-1] == t0
+
+    ###----------------------------------------------------------------------------
+    @staticmethod
+    def inside(t, tslices):
+
+        """
+        Vectorised version of :func:`valid`. Check if the times t are within
+        the boundaries of the sorted and non-overlapping intervals tslices.
+        Once flattened, the interval limits alternate between starts and
+        stops, so that a time is inside an interval if it is inserted at an
+        odd position.
+
+        Parameters
+        ----------
+        t : numpy array
+            Times in Julian days.
+        tslices : numpy array
+            Intervals, as an (N,2) array of Julian days, possibly empty.
+
+        Returns
+        -------
+        numpy array of booleans
+            True for the times within an interval.
+
+        """
+
+        return (np.searchsorted(np.ravel(tslices), t) & 1).astype(bool)
 
     ###------------------------------------------------------------------------
-    def force_night(self, altmin = 24*u.deg, depth = 3, npt = 150):
+    def force_night(self, altmin = 24*u.deg, depth = 3, npt = 48):
 
         """
         From an existing instance, compute the visibility assuming the night \
@@ -427,7 +702,7 @@ class Visibility():
         depth : integer, optional
             The number of nights considered. The default is 3.
         npt : integer, optional
-            `astroplan` number of search points. The default is 150.
+            Number of grid points per day. The default is 48.
         debug : boolean, optional
             If True, display information. The default is False.
 
@@ -441,47 +716,294 @@ class Visibility():
         self.status    = "Forced"
         self.depth     = depth
         self.altmin    = altmin
+        self.set_floats()
 
         # Horizon (defines the visibiltiy)
-        obs  = Observer(location  = self.site,
-                        name      = self.name,
-                        timezone  ="utc")
-
-        (high, self.t_event) = self.horizon(obs)
-        if len(self.t_event[0])==0 : # Above horizon period
-            self.t_true = [[]]
+        (high, t_above) = self.horizon(npt=npt)
+        self.t_event = IntervalSet(t_above)
+        if len(t_above)==0 : # Above horizon period
+            self.t_true = IntervalSet()
             self.vis_night = False # Not visibile even during night
         else:
             self.vis = True
             self.vis_prompt = True
-            self.t_event = [ [t[0], t[1]] for t in self.t_event]
             self.t_true = self.t_event
             self.vis_night = True
 
         # Infinite nights - starts at trigger (with margins)
-        self.t_twilight  = [[self.tstart - 0.1*u.d,
-                             self.tstop  + 0.1*u.d]] # Infini
+        self.t_twilight  = IntervalSet([[self.tstart_jd - 0.1,
+                                         self.tstop_jd  + 0.1]]) # Infini
 
         return self
 
     ###-----------------------------------------------------------------------
-    def nights(self, obs, npt=150):
+    def set_floats(self):
+
+        """
+        Copy the window limits and the altitude and distance thresholds to
+        plain floats (Julian days and degrees), used in the searches and
+        comparisons instead of the Time and Quantity public attributes.
+        To be called whenever these attributes are modified.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if isinstance(self.tstart, Time):
+            self.tstart_jd, self.tstop_jd = self.tstart.jd, self.tstop.jd
+
+        self.altmin_deg       = self.altmin.to_value(u.deg)
+        self.moon_maxalt_deg  = self.moon_maxalt.to_value(u.deg)
+        self.moon_mindist_deg = self.moon_mindist.to_value(u.deg)
+
+    ###-----------------------------------------------------------------------
+    def site_key(self):
+
+        """
+        Hashable key identifying the site, used to share the site dependent
+        objects among instances.
+
+        Returns
+        -------
+        tuple
+            Geocentric coordinates of the site in meters.
+
+        """
+
+        return tuple(u.Quantity(self.site.geocentric).to_value(u.m))
+
+    ###-----------------------------------------------------------------------
+    def altaz_frame(self, times):
+
+        """
+        Get the AltAz frame of the site at the given times. The frame is
+        built once per site and only the observation times are replaced.
+
+        Parameters
+        ----------
+        times : astropy Time
+            Observation times, a scalar or an array.
+
+        Returns
+        -------
+        astropy AltAz frame
+            The frame at the site location and the given times.
+
+        """
+
+        key = self.site_key()
+        if key not in _altaz_cache:
+            _altaz_cache[key] = AltAz(location=self.site)
+
+        return _altaz_cache[key].replicate_without_data(obstime=times)
+
+    ###-----------------------------------------------------------------------
+    def grid(self, npt=48):
+
+        """
+        Sample the observation window, with one day before the start and two
+        days after the stop so that the periods overlapping the window are
+        complete. The start time is one of the grid points. The AltAz frame
+        is built once and shared by all the objects (Sun, source).
+
+        Parameters
+        ----------
+        npt: integer
+            Number of points per day. The default is 48.
+
+        Returns
+        -------
+        jd : numpy array
+            Grid times in Julian days.
+        frame : astropy AltAz frame
+            The frame at the grid times and at the site location.
+
+        """
+
+        nafter = int(np.ceil(npt*(self.tstop_jd - self.tstart_jd + 2)))
+        jd     = self.tstart_jd + np.arange(-npt, nafter + 1)/npt
+        frame  = self.altaz_frame(Time(jd, format="jd", scale="utc"))
+
+        return (jd, frame)
+
+    ###-----------------------------------------------------------------------
+    def altitude(self, body, frame):
+
+        """
+        Altitude of the Sun, the Moon or the source in an AltAz frame.
+
+        Parameters
+        ----------
+        body : string
+            Either `sun`, `moon` or `source`.
+        frame : astropy AltAz frame
+            The frame, usually obtained from :func:`grid`.
+
+        Returns
+        -------
+        numpy array
+            Altitudes in degrees at the frame observation times.
+
+        """
+
+        if body == "sun":
+            coord = get_sun(frame.obstime)
+        elif body == "moon":
+            coord = self.moon_position(frame.obstime)
+        else:
+            coord = self.target
+
+        return coord.transform_to(frame).alt.deg
+
+    ###-----------------------------------------------------------------------
+    def moon_position(self, times, raw=False):
+
+        """
+        Topocentric position of the Moon seen from the site, obtained
+        directly from the ERFA approximate lunar theory (`moon98`, accurate
+        to a few arcseconds) on the whole time array, instead of
+        :func:`get_moon` which goes through the barycentric ephemeris and
+        the ICRS to GCRS transforms.
+
+        Parameters
+        ----------
+        times : astropy Time
+            Times, of any shape.
+        raw : bool, optional
+            If True, return the Cartesian positions from the site as a plain
+            (3, ...) array in meters, without building the coordinates.
+            The default is False.
+
+        Returns
+        -------
+        astropy SkyCoord or numpy array
+            The Moon positions in the GCRS frame of the site.
+
+        """
+
+        # The site GCRS positions are obtained once for the whole array
+        moon     = erfa.moon98(times.tdb.jd1, times.tdb.jd2)["p"] # au
+        pos, vel = self.site.get_gcrs_posvel(times)
+        xyz      = np.moveaxis(moon, -1, 0)*u.au - pos.xyz # From the site
+        if raw:
+            return xyz.to_value(u.m)
+
+        return SkyCoord(GCRS(CartesianRepresentation(xyz), obstime=times,
+                             obsgeoloc=pos, obsgeovel=vel))
+
+    ###-----------------------------------------------------------------------
+    @staticmethod
+    def crossings(jd, alt, h0):
+
+        """
+        Find the times at which a sampled altitude crosses a given value.
+        The time is obtained from the parabola going through the three grid
+        points around the crossing (quadratic interpolation of Montenbruck &
+        Pfleger), which is accurate to a few seconds even for hourly
+        samplings. The linear interpolation between the two grid points
+        bracketing the crossing is used if the parabola has no root in
+        between.
+        The grid is assumed to be regular.
+
+        Parameters
+        ----------
+        jd : numpy array
+            Grid times in Julian days.
+        alt : numpy array
+            Altitudes in degrees at the grid times.
+        h0 : float
+            Altitude to be crossed in degrees.
+
+        Returns
+        -------
+        t_up : numpy array
+            Times (Julian days) when the altitude goes above h0.
+        t_down : numpy array
+            Times (Julian days) when the altitude goes below h0.
+
+        """
+
+        y     = alt - h0
+        above = y > 0
+        idx   = np.flatnonzero(above[1:] != above[:-1]) # Crossing after idx
+        up    = above[idx+1]
+
+        # Parabola a*x**2 + b*x + y0 through the points around the crossing,
+        # x in grid steps from the central point
+        ic = np.clip(idx, 1, len(y) - 2)
+        (ym, y0, yp) = (y[ic-1], y[ic], y[ic+1])
+        a  = 0.5*(yp + ym) - y0
+        b  = 0.5*(yp - ym)
+
+        # Bracket of the crossing, and linear interpolation within
+        x1 = idx - ic
+        x  = x1 + y[idx]/(y[idx] - y[idx+1])
+
+        # Keep the root of the parabola within the bracket, if any
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sqd = np.sqrt(b**2 - 4*a*y0)
+            for root in [(-b + sqd)/(2*a), (-b - sqd)/(2*a)]:
+                ok    = (root >= x1) & (root <= x1 + 1)
+                x[ok] = root[ok]
+
+        t = jd[ic] + x*(jd[1] - jd[0])
+
+        return (t[up], t[~up])
+
+    ###-----------------------------------------------------------------------
+    @staticmethod
+    def search(t, t0, which="next"):
+
+        """
+        Get the first time after t0, or the last time before t0, from a sorted
+        list of times.
+
+        Parameters
+        ----------
+        t : numpy array
+            Sorted times in Julian days.
+        t0 : float
+            Reference time in Julian days.
+        which : string, optional
+            Either "next" or "previous". The default is "next".
+
+        Returns
+        -------
+        float
+            The time found, `nan` if none.
+
+        """
+
+        if which == "next":
+            i = np.searchsorted(t, t0, side="right")
+            return t[i] if i < len(t) else np.nan
+
+        i = np.searchsorted(t, t0, side="left") - 1
+        return t[i] if i >= 0 else np.nan
+
+    ###-----------------------------------------------------------------------
+    def nights(self, samples=None, npt=48):
 
         """
         Return night periods withinthe observation window.
+        The twilights are obtained from the Sun altitude computed at once on
+        a time grid.
 
         Parameters
         ----------
-        obs : Astroplan Observer instance
-            Current observation window.
+        samples : tuple, optional
+            Time grid (Julian days) and altitudes (degrees), computed on the
+            grid from :func:`grid` if None. The default is None.
         npt: integer
-            Number of points for window searches (Astroplan).
-            The default is 150.
+            Number of grid points per day if the grid is computed.
+            The default is 48.
 
         Returns
         -------
-        tnights : List of Time intervals
-            List of nights.
+        tnights : numpy array
+            Nights, as an (N,2) array of Julian days.
         is_night: Boolean
             True if the observation starts at night.
 
@@ -490,69 +1012,70 @@ class Visibility():
         tnights = []
         inight  = 0 # night (after trigger) counter
 
+        if samples is None:
+            with _fast_transforms(self.astrom_step):
+                jd, frame = self.grid(npt=npt)
+                samples   = (jd, self.altitude("sun", frame))
+        jd, alt = samples
+        dawns, dusks = self.crossings(jd, alt, -18)
+
         # Get the first night : can be the current night
-        is_night = obs.is_night(self.tstart, horizon = -18*u.deg)
+        # (the start time is a grid point, no need for another transform)
+        is_night = np.interp(self.tstart_jd, jd, alt) < -18
 
         if is_night:
             search="previous"
         else:
             search = "next"
 
-        t_dusk = obs.twilight_evening_astronomical(self.tstart,
-                                                    which = search,
-                                                    n_grid_points = npt)
-        t_dawn = obs.twilight_morning_astronomical(t_dusk,
-                                                    which="next",
-                                                    n_grid_points = npt)
+        t_dusk = self.search(dusks, self.tstart_jd, which = search)
+        t_dawn = self.search(dawns, t_dusk)
+
+        if np.isnan(t_dusk) or np.isnan(t_dawn):
+            print(">>> No night found, please check your input parameters")
+            return (is_night, np.empty((0, 2)))
+
         # Omit first night if requested
         inight = 1 # night counter
         if self.skip == 0: tnights.append([t_dusk, t_dawn])
 
         # Add subsequent nights until reaching the end of GRB data
-        while (t_dusk < self.tstop) and (inight < self.depth):
-            t_dusk = obs.twilight_evening_astronomical(t_dawn,
-                                                        which = "next",
-                                                        n_grid_points = npt)
-            t_dawn = obs.twilight_morning_astronomical(t_dusk,
-                                                        which = "next",
-                                                        n_grid_points = npt)
+        while (t_dusk < self.tstop_jd) and (inight < self.depth):
+            t_dusk = self.search(dusks, t_dawn)
+            t_dawn = self.search(dawns, t_dusk)
+            if np.isnan(t_dawn): break
+
             if inight >= self.skip:
                 tnights.append([t_dusk, t_dawn])
 
             inight +=1
 
-        # For test, add the previous night
-        # t_dawn0 = obs.twilight_morning_astronomical(self.grb.t_trig,
-        #                                            which="previous",
-        #                                            n_grid_points = npt)
-        # t_dusk0 = obs.twilight_evening_astronomical(t_dawn0,
-        #                                             which="previous",
-        #                                             n_grid_points = npt)
-        # tnights.append([t_dusk0.mjd, t_dawn0.mjd])
-
         if len(tnights) == 0:
             print(">>> No night found, please check your input parameters")
 
-        return (is_night, tnights)
+        return (is_night, np.array(tnights).reshape(-1, 2))
 
     ###-----------------------------------------------------------------------
-    def horizon(self, obs, npt=150):
+    def horizon(self, samples=None, npt=48):
 
         """
         Compute periods above horizon within the observation.
+        The rise and set times are obtained from the source altitude computed
+        at once on a time grid.
 
         Parameters
         ----------
-        obs : Astroplan Observer instance
-            Current observation window.
+        samples : tuple, optional
+            Time grid (Julian days) and altitudes (degrees), computed on the
+            grid from :func:`grid` if None. The default is None.
         npt: integer
-            Number of points for window searches (Astroplan).
-            The default is 150.
+            Number of grid points per day if the grid is computed.
+            The default is 48.
 
         Returns
         -------
-        t_above : List of Time intervals
-            List of periods above horizon.
+        t_above : numpy array
+            Periods above horizon, as an (N,2) array of Julian days.
         high: Boolean
             True if the observation starts above horizon.
 
@@ -560,114 +1083,126 @@ class Visibility():
 
         t_above = []
 
+        if samples is None:
+            with _fast_transforms(self.astrom_step):
+                jd, frame = self.grid(npt=npt)
+                samples   = (jd, self.altitude("source", frame))
+        jd, alt = samples
+        rises, sets = self.crossings(jd, alt, self.altmin_deg)
+
         # Get first period above horizon : can be the present period...
-        high = obs.target_is_up(self.tstart, self.target,
-                                horizon = self.altmin)
+        # (the start time is a grid point)
+        high = np.interp(self.tstart_jd, jd, alt) > self.altmin_deg
 
         if high:
             search="previous"
         else:
             search = "next"
 
-        t_rise = obs.target_rise_time(self.tstart,
-                                      self.target,
-                                      which   = search,
-                                      horizon = self.altmin,
-                                      n_grid_points = npt)
+        t_rise = self.search(rises, self.tstart_jd, which = search)
 
         # If rise time is undefined, this means that the GRB is always above
         # or below the horizon - Otherwise the set time can be found.
-        # Note that : if np.isnan(t_rise.mjd):
-        # through a Warning. After investigation the test implemented below
-        # seems correct (In numpy, Masked arrays, numpy.na, are arrays that may
-        # have missing or invalid entries.)
-        # if isinstance(t_rise.mjd ,np.ma.core.MaskedArray):
-        # With gammapy1.2 installation, slight change in the test:
-        if np.ma.is_masked(t_rise.mjd):
+        if np.isnan(t_rise):
             if high:
                 self.vis = True
-                return high, [[self.tstart,self.tstop]]
+                return high, np.array([[self.tstart_jd, self.tstop_jd]])
             else:
                 self.vis = False
-                return high, [[]]
+                return high, np.empty((0, 2))
         else:
             self.vis = True
-            t_set = obs.target_set_time(t_rise,
-                                        self.target,
-                                        which="next",
-                                        horizon = self.altmin,
-                                        n_grid_points = npt)
+            t_set = self.search(sets, t_rise)
 
             t_above.append([t_rise,t_set])
 
-
             # Add a subsequent above-horizon periods until GRB end of data
-            while t_set < self.tstop:
-                t_rise = obs.target_rise_time(t_set,
-                                          self.target,
-                                          which="next",
-                                          horizon = self.altmin,
-                                          n_grid_points = npt)
-                t_set = obs.target_set_time(t_rise,
-                                            self.target,
-                                            which="next",
-                                            horizon = self.altmin,
-                                            n_grid_points = npt)
+            while t_set < self.tstop_jd:
+                t_rise = self.search(rises, t_set)
+                t_set  = self.search(sets, t_rise)
+                if np.isnan(t_set): break
+
                 t_above.append([t_rise,t_set])
 
-        return (high, t_above)
+        return (high, np.array(t_above))
 
     ###-----------------------------------------------------------------------
     def moonlight_veto(self, dt, debug=False):
 
         """
-        Check if the Moon period defined by the rise and set time correspond
+        Check if the Moon periods defined by the rise and set times correspond
         to a situation where the moon is too bright or too close from the
         source.
         If this is the case (too bright or too close), returns True
         (the veto is confirmed).
+        All the periods are checked at once, with a single Moon position and
+        illumination computation.
 
         Parameters
         ----------
-        dt : Time interval
-            Current time interval.
+        dt : numpy array
+            Time intervals, as a pair or an (N,2) array of Julian days.
         debug : Boolean, optional
             If True, displays information. The default is False.
 
         Returns
         -------
-        too_bright : Boolean
-            True if Moon too bright.
-        too_close : Boolean
-            True if Moon too close.
+        too_bright : Boolean or numpy array of booleans
+            True if Moon too bright (per period).
+        too_close : Boolean or numpy array of booleans
+            True if Moon too close (per period).
 
         """
 
-        too_bright = False
-        too_close  = False
+        # All the times of all the periods at once
+        ts = Time(np.asarray(dt), format="jd", scale="utc")
 
         # Check moon illumination
-        for t in dt:
-            moonlight = moon_illumination(t)
-            if moonlight >= self.moon_maxlight:
-                too_bright = True
-                if debug:
-                    print("Moonlight :",moonlight," too bright ! -> confirmed")
-                break
-
-        # Check distance to source at rise and set
-        for t in dt:
-            moon_radec = get_moon(t, self.site)
-            dist = moon_radec.separation(self.target.coord)
-            if dist <= self.moon_mindist:
-                too_close = True
-                if debug:
-                    print(" Moon Distance : ",dist,"too close !")
-                break
+        moonlight  = moon_illumination(ts)
+        too_bright = (moonlight >= self.moon_maxlight).any(axis=-1)
+        if debug and np.any(too_bright):
+            print("Moonlight :",moonlight," too bright ! -> confirmed")
+
+        # Check distance to source at rise and set, compared in degrees
+        # on the whole array
+        dist      = self.separation_deg(self.moon_position(ts, raw=True))
+        too_close = (dist <= self.moon_mindist_deg).any(axis=-1)
+        if debug and np.any(too_close):
+            print(" Moon Distance : ",dist,"too close !")
 
         return (too_bright, too_close)
 
+    ###-----------------------------------------------------------------------
+    def separation_deg(self, coord):
+
+        """
+        Angular distance from the target, from the dot product of the unit
+        vectors on plain float arrays. The frame differences (aberration) are
+        neglected, i.e. a few tens of arcseconds at most.
+
+        Parameters
+        ----------
+        coord : astropy SkyCoord or numpy array
+            Positions, of any shape (e.g. the Moon at various times), or
+            their Cartesian coordinates as a (3, ...) array.
+
+        Returns
+        -------
+        numpy array
+            Distances in degrees, with the shape of coord.
+
+        """
+
+        t_xyz = self.target.icrs.cartesian.xyz.value # Unit vector
+        if isinstance(coord, SkyCoord):
+            coord = coord.cartesian.xyz.value
+        xyz   = coord/np.linalg.norm(coord, axis=0)
+        cos   = np.einsum("i,i...->...", t_xyz, xyz)
+
+        return np.degrees(np.arccos(np.clip(cos, -1, 1)))
+
     ###----------------------------------------------------------------------------
+    @staticmethod
     def moon_halo(x, r0 = 0.5, rc=30, epsilon=0.1, q0 = 1):
 
         """
@@ -678,7 +1213,7 @@ class Visibility():
 
         Parameters
         ----------
-        x : float
+        x : float or numpy array
             Distance from the Moon.
         r0 : float, optional
             Moon radius. The default is 0.5.
@@ -691,16 +1226,18 @@ class Visibility():
 
         Returns
         -------
-        f : float
+        f : float or numpy array
             Moon halo intensity.
 
         """
 
-        f = 1/ ( (1 -epsilon)/(q0*epsilon)/(rc-r0)**2 * (x-r0)**2 + 1/q0)
+        a = (1 -epsilon)/(q0*epsilon)/(rc-r0)**2 # Once, also for arrays
+        f = 1/ (a*(np.asarray(x) - r0)**2 + 1/q0)
         #f = 0.5*(1 - abs(r0-x)/(r0-x))* f + 0.5*(1 - abs(x-r0)/(x-r0))*q0
         return f
 
     ###----------------------------------------------------------------------------
+    @staticmethod
     def moon_halo_veto(q0, threshold=0.1, r0 = 0.5, rc=30, epsilon=0.1):
 
         """
@@ -709,8 +1246,8 @@ class Visibility():
 
         Parameters
         ----------
-        q0 : float, optional
-            Moon light intensity (arbitrary unit). The default is 1.
+        q0 : float or numpy array
+            Moon light intensity (arbitrary unit).
         threshold: float
             Affordable Moon light liminosity. The default is O.1.
         r0 : float, optional
@@ -723,78 +1260,93 @@ class Visibility():
 
         Returns
         -------
-        float
+        float or numpy array
             Radius with affordbale Moon light intensity.
 
         """
 
-        a = (1 -epsilon)/epsilon/q0/(rc-r0)**2
+        q0 = np.asarray(q0)
+        a  = (1 -epsilon)/epsilon/q0/(rc-r0)**2
         return np.sqrt((1/threshold - 1/q0)/a)
 
     ###-----------------------------------------------------------------------
-    def moon_alt_veto(self, obs, npt=150):
+    def moon_alt_veto(self, samples=None, npt=48):
 
         """
         The first veto is the Moon alitude.
-        First find windows where the Moon is too high
+        First find windows where the Moon is too high.
+        The rise and set times are obtained from the Moon altitude computed at
+        once on a time grid: the sign changes bracket the crossings, which are
+        then refined with a quadratic interpolation (see :func:`crossings`),
+        without any additional transform.
 
         Parameters
         ----------
-        obs : Astroplan Observer instance
-            Current observation window.
+        samples : tuple, optional
+            Time grid (Julian days) and altitudes (degrees), computed on the
+            grid from :func:`grid` if None. The default is None.
         npt: integer
-            Number of points for window searches (Astroplan).
-            The default is 150.
+            Number of grid points per day if the grid is computed.
+            The default is 48.
 
         Returns
         -------
-        tmoons : List of Time intervals
-            Periods where the Moon light is not affordable for the observation.
+        tmoons : numpy array
+            Periods where the Moon light is not affordable for the
+            observation, as an (N,2) array of Julian days.
 
         """
 
-        tmoons = []
+        if samples is None:
+            with _fast_transforms(self.astrom_step):
+                jd, frame = self.grid(npt=npt)
+                samples   = (jd, self.altitude("moon", frame))
+        jd, alt = samples
+        rises, sets = self.crossings(jd, alt, self.moon_maxalt_deg)
 
         # Is the Moon there at trigger tigger time ?
-        radec = get_moon(self.tstart, obs.location)
-        altaz = radec.transform_to(AltAz(location = obs.location,
-                                         obstime  = self.tstart))
-
         # Search next rise except if Moon is already here
         search="next"
-        if altaz.alt > self.moon_maxalt:
+        high = np.interp(self.tstart_jd, jd, alt) > self.moon_maxalt_deg
+        if high:
             search="previous"
 
-        t_rise = obs.moon_rise_time(self.tstart,
-                                    which = search, horizon=self.moon_maxalt,
-                                    n_grid_points = npt)
-        # if np.isnan(t_rise.mjd):
-        if isinstance(t_rise.mjd ,np.ma.core.MaskedArray):
+        t_rise = self.search(rises, self.tstart_jd, which = search)
+        if np.isnan(t_rise):
+            if high: # Moon is always up
+                return np.array([[self.tstart_jd, self.tstop_jd]])
             # Moon will never rise
             print(" >>>>> Moon will never rise above ",self.moon_maxalt)
-            return [[]] # No veto period
+            return np.empty((0, 2)) # No veto period
 
-        t_set  = obs.moon_set_time(t_rise,
-                                   which="next", horizon=self.moon_maxalt,
-                                   n_grid_points = npt)
+        # If the Moon does not set within the grid, the period is closed at
+        # the end of the window, if it rises within it
+        t_set  = self.search(sets, t_rise)
+        if np.isnan(t_set):
+            if t_rise >= self.tstop_jd: # Out of the window
+                return np.empty((0, 2)) # No veto period
+            t_set = self.tstop_jd
 
-        tmoons.append([t_rise, t_set])
+        # There cannot be more periods than rises
+        tmoons    = np.empty((len(rises), 2))
+        tmoons[0] = (t_rise, t_set)
+        nmoon     = 1
 
         # Add subsequent nights until reaching the end of GRB data
-        while t_set < self.tstop:
-            t_rise = obs.moon_rise_time(t_set,
-                                        which = "next", horizon=self.moon_maxalt,
-                                        n_grid_points = npt)
-            t_set  = obs.moon_set_time(t_rise,
-                                       which = "next",  horizon=self.moon_maxalt,
-                                       n_grid_points = npt)
-
-            tmoons.append([t_rise, t_set])
-
-        if len(tmoons):
-            return tmoons
-        else:
-            return [[]]
+        # The cursor (t_set) is a float Julian day, NaN if nothing is found,
+        # no Time object is built in the loop
+        while t_set < self.tstop_jd:
+            t_rise = self.search(rises, t_set)
+            if np.isnan(t_rise): break
+            t_set  = self.search(sets, t_rise)
+            if np.isnan(t_set):
+                if t_rise >= self.tstop_jd: break # Out of the window
+                t_set = self.tstop_jd
+
+            tmoons[nmoon] = (t_rise, t_set)
+            nmoon += 1
+
+        return tmoons[:nmoon]
 
     ###------------------------------------------------------------------------
     @classmethod
@@ -842,9 +1394,9 @@ class Visibility():
 
             # Check undefined intervals
             if dt[0][0].value == -9 or dt[0][1].value == -9:
-                return [[]]
+                return IntervalSet()
             else:
-                return dt
+                return IntervalSet.from_times(dt)
         # ----------------------------------------------------
 
          # Visibility has been computed with this minimum altitude
@@ -862,6 +1414,7 @@ class Visibility():
         inst.t_true     = f(vis["True"],loc)
         inst.t_twilight = f(vis["Twilight"],loc)
         inst.t_event    = f(vis["Event"],loc)
+        inst.set_floats()
 
         return inst
 
@@ -888,9 +1441,8 @@ class Visibility():
         inst.site    = EarthLocation.from_geocentric(x=u.Quantity(d["site"][0]),
                                                     y=u.Quantity(d["site"][1]),
                                                     z=u.Quantity(d["site"][2]))
-        inst.target = FixedTarget(SkyCoord(ra=u.Quantity(d["target"][0]),
-                                           dec=u.Quantity(d["target"][1])),
-                                           name="Source")
+        inst.target = SkyCoord(ra  = u.Quantity(d["target"][0]),
+                               dec = u.Quantity(d["target"][1]))
 
         inst.name            = d["name"]
         inst.moon_maxlight   = d["moon_maxlight"]
@@ -903,11 +1455,209 @@ class Visibility():
         for key in ["altmin","moon_maxalt", "moon_mindist"]:
             inst.__dict__[key] = u.Quantity(d[key])
 
-        for key in ["tstart","tstop","t_true","t_twilight","t_event","t_moon_up"]:
-            inst.__dict__[key] = Time(d[key],format="mjd")
+        for key in ["tstart","tstop"]:
+            inst.__dict__[key] = Time(d[key], format="mjd", scale="utc")
+
+        for key in ["t_true","t_twilight","t_event","t_moon_up"]:
+            mjd = np.reshape(d[key], (-1, 2))
+            inst.__dict__[key] = IntervalSet(mjd + 2400000.5) # Julian days
+        inst.set_floats()
+
+        return inst
+
+    ###-----------------------------------------------------------------------
+    @staticmethod
+    def jd_array(tlist):
+
+        """
+        Convert periods, either an IntervalSet or a list of pairs of Time
+        objects (possibly [[]]), into an (N,2) array of Julian days.
+
+        Parameters
+        ----------
+        tlist : IntervalSet or list of Time intervals
+            The periods.
+
+        Returns
+        -------
+        numpy array
+            The periods as an (N,2) array of Julian days, possibly empty.
+
+        """
+
+        if isinstance(tlist, IntervalSet):
+            return tlist.jd
+
+        return IntervalSet.from_times(tlist).jd
+
+    ###-----------------------------------------------------------------------
+    def compact(self):
+
+        """
+        Get the state of the instance as a dictionnary of numpy arrays (times
+        in Julian days, angles in degrees, site in meters).
+
+        Returns
+        -------
+        Dictionnary
+            The instance state.
+
+        """
+
+        return {"name"          : np.array(self.name),
+                "status"        : np.array(self.status),
+                "site"          : u.Quantity(self.site.geocentric)
+                                   .to_value(u.m),
+                "target"        : np.array([self.target.ra.deg,
+                                            self.target.dec.deg]),
+                "window"        : np.array([self.tstart.jd, self.tstop.jd]),
+                "altmin"        : self.altmin.to_value(u.deg),
+                "moon_maxalt"   : self.moon_maxalt.to_value(u.deg),
+                "moon_mindist"  : self.moon_mindist.to_value(u.deg),
+                "moon_maxlight" : self.moon_maxlight,
+                "depth"         : self.depth,
+                "skip"          : self.skip,
+                "flags"         : np.array([self.vis, self.vis_night,
+                                            self.vis_prompt]),
+                "t_true"        : self.jd_array(self.t_true),
+                "t_twilight"    : self.jd_array(self.t_twilight),
+                "t_event"       : self.jd_array(self.t_event),
+                "t_moon_up"     : self.jd_array(self.t_moon_up),
+                "moon_too_bright": np.array(self.moon_too_bright, dtype=bool),
+                "moon_too_close" : np.array(self.moon_too_close, dtype=bool)}
+
+    ###-----------------------------------------------------------------------
+    @classmethod
+    def from_compact(cls, d):
+
+        """
+        Create an instance from the dictionnary obtained with
+        :func:`compact`.
+
+        Parameters
+        ----------
+        d : Dictionnary
+            The instance state.
+
+        Returns
+        -------
+        inst : Visibility instance
+            Instance.
+
+        """
+
+        window = Time(d["window"], format="jd", scale="utc")
+        inst   = cls(pos    = SkyCoord(d["target"][0]*u.deg,
+                                       d["target"][1]*u.deg, frame="icrs"),
+                     site   = EarthLocation.from_geocentric(*d["site"],
+                                                            unit="m"),
+                     window = [window[0], window[1]],
+                     status = str(d["status"]),
+                     name   = str(d["name"]))
+
+        inst.altmin        = float(d["altmin"])*u.deg
+        inst.moon_maxalt   = float(d["moon_maxalt"])*u.deg
+        inst.moon_mindist  = float(d["moon_mindist"])*u.deg
+        inst.moon_maxlight = float(d["moon_maxlight"])
+        inst.depth         = int(d["depth"])
+        inst.skip          = int(d["skip"])
+
+        (inst.vis, inst.vis_night, inst.vis_prompt) = \
+                                        [bool(x) for x in d["flags"]]
+
+        for key in ["t_true","t_twilight","t_event","t_moon_up"]:
+            inst.__dict__[key] = IntervalSet(d[key])
+
+        inst.moon_too_bright = [bool(x) for x in d["moon_too_bright"]]
+        inst.moon_too_close  = [bool(x) for x in d["moon_too_close"]]
+        inst.set_floats()
 
         return inst
 
+    ###-----------------------------------------------------------------------
+    def __setstate__(self, state):
+
+        """
+        Restore a pickled instance. Older pickles (`_vis.bin` files) have an
+        astroplan FixedTarget as a target and miss the float attributes,
+        they are brought up to date so that they can be recomputed.
+
+        Parameters
+        ----------
+        state : Dictionnary
+            The pickled instance dictionnary.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.__dict__.update(state)
+
+        if isinstance(self.target, FixedTarget):
+            self.target = self.target.coord
+        self.set_floats()
+
+    ###-----------------------------------------------------------------------
+    def write(self, folder=".", debug=False):
+
+        """
+        Write the instance to a compressed `numpy` file, `name_vis.npz`, in
+        the given folder. Only the numerical state is stored (see
+        :func:`compact`), which is much smaller and faster to read than a
+        pickled instance with its astropy objects.
+
+        Parameters
+        ----------
+        folder : string, optional
+            Output folder. The default is ".".
+        debug : boolean, optional
+            If True, say something. The default is False.
+
+        Returns
+        -------
+        filename : Path
+            Output file name.
+
+        """
+
+        filename = Path(folder, self.name+"_vis.npz")
+        np.savez_compressed(filename, **self.compact())
+
+        if debug:
+            print("Visibility {} written to {}".format(self.name, filename))
+
+        return filename
+
+    ###-----------------------------------------------------------------------
+    @classmethod
+    def read(cls, filename):
+
+        """
+        Read an instance from a file written by :func:`write`.
+        Legacy pickled instances (`name_vis.bin` files) are still read, but
+        archived ones might not be valid anymore.
+
+        Parameters
+        ----------
+        filename : string or Path
+            Input file name, either a `.npz` or a legacy `.bin` file.
+
+        Returns
+        -------
+        Visibility instance
+            Instance.
+
+        """
+
+        if Path(filename).suffix == ".bin":
+            with open(filename, "rb") as f:
+                return pickle.load(f)
+
+        with np.load(filename) as data:
+            return cls.from_compact(dict(data))
+
     ###-----------------------------------------------------------------------
     def to_json(self,file=None, debug=False):
 
@@ -949,22 +1699,21 @@ class Visibility():
         Note that this function explicitely returns a dictionnary.
         Written by K. Kosack, September 2022
         """
-        from visibility import Visibility
-        from astropy.time import Time
-        import astropy.units.quantity
-        from   astroplan import FixedTarget
 
         if isinstance(obj, Visibility):
             return {k:v for k,v in obj.__dict__.items()
                     if k not in Visibility.ignore}
 
         if isinstance(obj, Time): return obj.mjd
-        if isinstance(obj, FixedTarget):
+        if isinstance(obj, IntervalSet):
+            if len(obj.starts) == 0: return [[]]
+            return Time(obj.jd, format="jd", scale="utc").mjd.tolist()
+        if isinstance(obj, SkyCoord):
             return (str(u.Quantity(obj.ra)),
                     str(u.Quantity(obj.dec)) )
-        if isinstance(obj, astropy.coordinates.earth.EarthLocation):
+        if isinstance(obj, EarthLocation):
             return [str(obj.x), str(obj.y), str(obj.z)]
-        if isinstance(obj, astropy.units.quantity.Quantity): return str(obj)
+        if isinstance(obj, u.Quantity): return str(obj)
 
         return
     ###------------------------------------------------------------------------
@@ -994,36 +1743,69 @@ class Visibility():
         if parfile is None:
             parfile = Visibility.def_vis_dicts
 
+        filename = Path(Path(__file__).parent, parfile)
         try:
-            with open(Path(Path(__file__).parent, parfile)) as file:
-                visdict  = yaml.load(file, Loader=SafeLoader)
-                if keyword in visdict.keys():
-
-                    if debug:
-                        print("   Vis. computed up to   : {} night(s)"
-                                .format(keyword["depth"]))
-                        print("   Skip up to            : {} night(s)"
-                                .format(keyword["skip"]))
-                        print("   Minimum altitude      : {}"
-                                .format(keyword["altmin"]))
-                        print("   Moon max. altitude    : {}"
-                                .format(keyword["altmoon"]))
-                        print("   Moon min. distance    : {}"
-                                .format(keyword["moondist"]))
-                        print("   Moon max. brightness  : {}"
-                                .format(keyword["moonlight"]))
-
-                    return visdict[keyword]
-                else:
-                    if debug:
-                        print("{}.py: visibility keyword not referenced"
-                             .format(__name__))
-                    return None
+            if filename not in _visdict_cache:
+                with open(filename) as file:
+                    _visdict_cache[filename] = yaml.load(file,
+                                                         Loader=SafeLoader)
+            visdict = _visdict_cache[filename]
+            if keyword in visdict.keys():
+
+                if debug:
+                    print("   Vis. computed up to   : {} night(s)"
+                            .format(keyword["depth"]))
+                    print("   Skip up to            : {} night(s)"
+                            .format(keyword["skip"]))
+                    print("   Minimum altitude      : {}"
+                            .format(keyword["altmin"]))
+                    print("   Moon max. altitude    : {}"
+                            .format(keyword["altmoon"]))
+                    print("   Moon min. distance    : {}"
+                            .format(keyword["moondist"]))
+                    print("   Moon max. brightness  : {}"
+                            .format(keyword["moonlight"]))
+
+                return dict(visdict[keyword]) # Copy, the cache is shared
+            else:
+                if debug:
+                    print("{}.py: visibility keyword not referenced"
+                         .format(__name__))
+                return None
 
         except IOError:
             sys.exit("{}.py: {} not found"
                      .format(__name__, parfile))
 
+    ###------------------------------------------------------------------------
+    @staticmethod
+    def decode_params(param):
+
+        """
+        Decode once the quantities of a visibility parameter dictionnary
+        (e.g. obtained from :func:`params_from_key`) so that it can be passed
+        to :func:`compute` for many sources without being parsed again.
+        Values already decoded are kept as they are.
+
+        Parameters
+        ----------
+        param : Dictionnary
+            Parameters used to compute the visibility.
+
+        Returns
+        -------
+        Dictionnary
+            A copy of the input with the angles as astropy Quantities.
+
+        """
+
+        decoded = dict(param)
+        for key in ["altmin", "altmoon", "moondist"]:
+            if not isinstance(param[key], u.Quantity):
+                decoded[key] = u.Quantity(param[key])
+
+        return decoded
+
     ###------------------------------------------------------------------------
     def print(self, log=None):
 
@@ -1061,11 +1843,11 @@ class Visibility():
                 if len(t[0]) == 0:
                     log.prt(" {:6s} : {:26s} * {:26s}".format(case,"--","--"))
                     return
-                for i, elt in enumerate(t):
-                    t1 = elt[0]
-                    t2 = elt[1]
+                # All dates converted at once
+                iso = Time(Visibility.jd_array(t), format="jd", scale="utc").iso
+                for i, (t1, t2) in enumerate(iso):
                     log.prt(" {:6s} : {} * {}"
-                            .format(case, Dp(t1), Dp(t2)),end="")
+                            .format(case, t1, t2),end="")
                     # t1  = (t1-self.grb.t_trig).sec*u.s
                     # t2  = (t2-self.grb.t_trig).sec*u.s
                     # log.prt("        : {:7.2f} {:6.2f} * {:7.2f} {:6.2f}"
@@ -1080,12 +1862,10 @@ class Visibility():
                 return
             #-------------------
 
-            with warnings.catch_warnings():
-                warnings.filterwarnings("ignore")
-                show(self.t_event,case="Event") # Event - above altmin
-                show(self.t_twilight,case="Twil.")  # Twilight - Dark time
-                show(self.t_moon_up,case="Moon")  # Moon altitude veto
-                show(self.t_true,case="True")  # True : dark time + altmin + triggered
+            show(self.t_event,case="Event") # Event - above altmin
+            show(self.t_twilight,case="Twil.")  # Twilight - Dark time
+            show(self.t_moon_up,case="Moon")  # Moon altitude veto
+            show(self.t_true,case="True")  # True : dark time + altmin + triggered
             log.prt("+----------------------------------------------------------------+")
 
         return
@@ -1132,17 +1912,19 @@ class Visibility():
                 delta_max.
 
             """
-            delta1 = abs(tnew[0] -torg[0])
-            delta2 = abs(tnew[1] -torg[1])
-            if delta1 > delta_max or delta2 > delta_max:
+            # Both pairs at once, in seconds
+            jd    = Visibility.jd_array([tnew, torg])
+            delta = np.abs(jd[0] - jd[1])*86400
+            if np.any(delta > delta_max.to_value(u.s)):
 
                 if log is not None:
+                    dates = Time(jd, format="jd", scale="utc").to_datetime()
                     log.prt("   ==> {:>10s}: {} * {}"
-                            .format(case,tnew[0].datetime,tnew[1].datetime))
+                            .format(case,*dates[0]))
                     log.prt("   ==> {:>10s}: {} * {}"
-                          .format("was",torg[0].datetime,torg[1].datetime))
+                          .format("was",*dates[1]))
                     log.prt("   ==> {:>10s}: {:26.2f} * {:26.2f}"
-                          .format("Delta",delta1.sec,delta2.sec))
+                          .format("Delta",*delta))
                     log.prt("   ==> Not compatible with original values")
 
                 return False
@@ -1150,16 +1932,19 @@ class Visibility():
                 return True
         #----------------------------------------------------------------
 
+        if log is None:
+            log = Log()
+
         matching = True
-        log.prt(" *** Check {} {}, '{}' and '{}' with tolerance : {}"
-                .format(self.grb.name,self.loc,self.name,view.name,delta_max),end=" ")
+        log.prt(" *** Check '{}' and '{}' with tolerance : {}"
+                .format(self.name,view.name,delta_max),end=" ")
 
         # Check that general visibilities agree - if not return False
         if self.vis != view.vis:
             log.prt(" ==> Vis wrong ", end="")
             matching = False
-        if self.vis_tonight != view.vis_tonight:
-            log.prt(" ==> Vis_tonight wrong ",end="")
+        if self.vis_night != view.vis_night:
+            log.prt(" ==> Vis_night wrong ",end="")
             matching = False
         if self.vis_prompt != view.vis_prompt:
             log.prt(" ==> Vis_prompt wrong ",end="")
@@ -1176,13 +1961,13 @@ class Visibility():
         if self.vis == False:
             log.prt ("--- not visible")
             return True
-        if self.tonight == False:
+        if self.vis_night == False:
             log.prt ("--- not tonight")
             return True
 
         # both "tonight" are OK, compare delta-time
 
-        if self.tonight and view.vis_tonight:
+        if self.vis_night and view.vis_night:
             print()
             # status(self.t_above,self.grb.t_event,case = "Above")
             # status(self.t_night,self.grb.t_twilight,case = "Night")
@@ -1281,8 +2066,7 @@ class Visibility():
                     ax[1].grid("both",ls="--",alpha=0.5)
 
                     ### Moon altitude
-                    alt = radec.transform_to(AltAz(location=self.site,
-                                                   obstime=tobs)).alt
+                    alt = radec.transform_to(self.altaz_frame(tobs)).alt
                     moon_alt_plot(tobs, alt, ax = ax[1], alpha=0.5)
                     ax[1].axhline(y=self.moon_maxalt ,
                                color= "darkblue", alpha=1, ls=":")
@@ -1335,7 +2119,8 @@ class Visibility():
             axis.tick_params(axis='x', rotation=45)
             axis.set_xlabel("Date")
             axis.grid("both",ls="--",alpha=0.5)
-            axis.set_xlim([min(tobs).datetime,max(tobs).datetime])
+            axis.set_xlim(Time([tobs.min().jd, tobs.max().jd], format="jd",
+                               scale=tobs.scale).to_datetime())
 
         fig.tight_layout(h_pad=0, w_pad=0)
 
@@ -1352,16 +2137,20 @@ class Visibility():
         ax = plt.gca() if ax is None else ax
 
         if len(twindow[0]) == 0: return ax
-        for elt in twindow:
-            if elt[0] != -9 and elt[1] != -9:  # Check if -9, i.e. undefined
-                t1  = (elt[0] - tshift).datetime
-                t2  = (elt[1] - tshift).datetime
-                if isinstance(tag, list):
-                    ax.axvline(t1,color=color,label=tag[0])
-                    ax.axvline(t2,color=color2,label=tag[1])
-                else:
-                    ax.axvspan(t1,t2,
-                               alpha = alpha, color=color,label=tag,**kwargs)
+
+        # Check if -9, i.e. undefined, and convert all dates at once
+        twindow = [elt for elt in twindow if elt[0] != -9 and elt[1] != -9]
+        if len(twindow) == 0: return ax
+        dates = (Time(Visibility.jd_array(twindow), format="jd", scale="utc")
+                 - tshift).to_datetime()
+
+        for (t1, t2) in dates:
+            if isinstance(tag, list):
+                ax.axvline(t1,color=color,label=tag[0])
+                ax.axvline(t2,color=color2,label=tag[1])
+            else:
+                ax.axvspan(t1,t2,
+                           alpha = alpha, color=color,label=tag,**kwargs)
 
         return ax
 
@@ -1431,10 +2220,11 @@ if __name__ == "__main__":
         grb.plot_energy_spectra()
         grb.plot_time_spectra()
 
-        for loc in ["North","South"]:
+        for loc in ("North", "South"):
             grb.set_visibility(item,loc,info=visinfo)
-            grb.vis[loc].print(log)
-            grb.vis[loc].plot(grb)
+            vis = grb.vis[loc]
+            vis.print(log)
+            vis.plot(grb)
 
     log.close()
 